@@ -0,0 +1,19 @@
+-- Deploy FileDimension:feature/covering_parent_name_index to pg
+
+BEGIN;
+
+-- Replace the plain UNIQUE(parent_id, file_name) constraint with a unique
+-- index that also carries the columns a scan compares, so the per-directory
+-- lookup is answered by an index-only scan. It still serves as the arbiter
+-- for INSERT ... ON CONFLICT (parent_id, file_name).
+CREATE UNIQUE INDEX idx_dim_file_parent_name
+ON public.dim_file (parent_id, file_name)
+INCLUDE (is_directory, file_size, device_id, inode, modified_at, hash_type);
+
+ALTER TABLE public.dim_file
+  DROP CONSTRAINT dim_file_parent_id_file_name_key;
+
+COMMENT ON INDEX public.idx_dim_file_parent_name
+  IS 'A file/directory must be unique within its parent directory. Covers the columns used to detect unchanged files.';
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Deploy FileDimension:feature/head_hash to pg
+
+BEGIN;
+
+-- Add the columns used by two-tier (head, then full) hashing
+ALTER TABLE public.dim_file
+  ADD COLUMN head_hash BYTEA,
+  ADD COLUMN hash_type TEXT CHECK (hash_type IN ('head', 'full'));
+
+-- Rows hashed before this change are left with hash_type NULL. The scan only
+-- skips rows that have a hash_type, so each of them is rehashed once and gets
+-- its head_hash; until then they can't be matched as duplicate candidates.
+
+-- Index for finding files that may be duplicates by size and head hash
+CREATE INDEX idx_file_dimension_size_head_hash ON public.dim_file(file_size, head_hash) WHERE head_hash IS NOT NULL;
+
+COMMENT ON COLUMN public.dim_file.head_hash
+  IS 'The SHA-384 hash of the first 1 MiB of the file''s content. NULL for directories.';
+COMMENT ON COLUMN public.dim_file.hash_type
+  IS 'Whether file_hash holds a full content hash (''full'') or only head_hash is known so far (''head'').';
+
+COMMIT;
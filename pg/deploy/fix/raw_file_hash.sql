@@ -0,0 +1,19 @@
+-- Deploy FileDimension:fix/raw_file_hash to pg
+
+BEGIN;
+
+-- Earlier scans stored the 96-character hex digest as bytes. Convert those
+-- rows to the raw 48-byte digest the schema always intended.
+UPDATE public.dim_file
+SET file_hash = decode(encode(file_hash, 'escape'), 'hex')
+WHERE octet_length(file_hash) = 96;
+
+UPDATE public.dim_file
+SET head_hash = decode(encode(head_hash, 'escape'), 'hex')
+WHERE octet_length(head_hash) = 96;
+
+ALTER TABLE public.dim_file
+  ADD CONSTRAINT dim_file_file_hash_length CHECK (octet_length(file_hash) = 48),
+  ADD CONSTRAINT dim_file_head_hash_length CHECK (octet_length(head_hash) = 48);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Revert FileDimension:feature/covering_parent_name_index from pg
+
+BEGIN;
+
+ALTER TABLE public.dim_file
+  ADD CONSTRAINT dim_file_parent_id_file_name_key UNIQUE (parent_id, file_name);
+
+DROP INDEX public.idx_dim_file_parent_name;
+
+COMMIT;
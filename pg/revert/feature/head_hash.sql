@@ -0,0 +1,11 @@
+-- Revert FileDimension:feature/head_hash from pg
+
+BEGIN;
+
+DROP INDEX public.idx_file_dimension_size_head_hash;
+
+ALTER TABLE public.dim_file
+  DROP COLUMN head_hash,
+  DROP COLUMN hash_type;
+
+COMMIT;
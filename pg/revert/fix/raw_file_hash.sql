@@ -0,0 +1,17 @@
+-- Revert FileDimension:fix/raw_file_hash from pg
+
+BEGIN;
+
+ALTER TABLE public.dim_file
+  DROP CONSTRAINT dim_file_file_hash_length,
+  DROP CONSTRAINT dim_file_head_hash_length;
+
+UPDATE public.dim_file
+SET file_hash = convert_to(encode(file_hash, 'hex'), 'UTF8')
+WHERE octet_length(file_hash) = 48;
+
+UPDATE public.dim_file
+SET head_hash = convert_to(encode(head_hash, 'hex'), 'UTF8')
+WHERE octet_length(head_hash) = 48;
+
+COMMIT;
@@ -0,0 +1,8 @@
+-- Verify FileDimension:feature/covering_parent_name_index on pg
+
+-- Verify that the covering unique index exists.
+-- The query should return a single row with a "true" value to pass.
+SELECT TRUE
+FROM pg_indexes
+WHERE schemaname = 'public'
+  AND indexname = 'idx_dim_file_parent_name';
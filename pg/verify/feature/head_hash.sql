@@ -0,0 +1,8 @@
+-- Verify FileDimension:feature/head_hash on pg
+
+-- The query should return a single row with a "true" value to pass.
+SELECT COUNT(*) = 2 AS columns_exist
+FROM information_schema.columns
+WHERE table_schema = 'public'
+  AND table_name   = 'dim_file'
+  AND column_name  IN ('head_hash', 'hash_type');
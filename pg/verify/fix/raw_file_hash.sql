@@ -0,0 +1,7 @@
+-- Verify FileDimension:fix/raw_file_hash on pg
+
+-- The query should return a single row with a "true" value to pass.
+SELECT COUNT(*) = 2 AS constraints_exist
+FROM information_schema.check_constraints
+WHERE constraint_schema = 'public'
+  AND constraint_name IN ('dim_file_file_hash_length', 'dim_file_head_hash_length');
@@ -3,10 +3,11 @@
 import json
 import typer
 
+from collections import defaultdict
 from datetime import datetime
 from . import processor
 from .config import logger, MAX_FILES as MAX_FILES_FROM_ENV  # Rename for clarity
-from .database import SessionLocal, find_duplicate_sets, get_full_path_for_id, prune_database
+from .database import SessionLocal, find_duplicate_sets, get_full_paths_bulk, prune_database
 from sqlalchemy import text
 
 app = typer.Typer()
@@ -15,13 +16,11 @@ app = typer.Typer()
 # --- Helper function for formatting bytes ---
 def format_bytes(size: int) -> str:
 	"""Formats a size in bytes into a human-readable string."""
-	power = 1024
-	n = 0
-	power_labels = {0: '', 1: 'K', 2: 'M', 3: 'G', 4: 'T'}
-	while size > power and n < len(power_labels):
-		size /= power
-		n += 1
-	return f"{size:.2f} {power_labels[n]}B"
+	power_labels = ('', 'K', 'M', 'G', 'T')
+	size = int(size)
+	# Each label is a factor of 2**10, so the bit length picks it directly
+	n = 0 if size < 1024 else min((size.bit_length() - 1) // 10, len(power_labels) - 1)
+	return f"{size / (1 << (10 * n)):.2f} {power_labels[n]}B"
 
 
 @app.command()
@@ -61,18 +60,25 @@ def find_dupes(
 			logger.info("No duplicate files found.")
 			return
 
-		path_cache = {}  # Cache for reconstructing paths efficiently
+		# Fetch every file record for all duplicate hashes in a single query
+		hashes = [dupe_set['file_hash'] for dupe_set in duplicate_sets]
+		file_records = db_session.execute(
+			text("SELECT file_hash, id FROM public.dim_file WHERE file_hash = ANY(:hashes)"),
+			{"hashes": hashes}
+		).fetchall()
+
+		ids_by_hash = defaultdict(list)
+		for record in file_records:
+			ids_by_hash[bytes(record.file_hash)].append(record.id)
+
+		# Resolve the paths of just these files in one recursive query
+		path_map = get_full_paths_bulk(db_session, [record.id for record in file_records])
+
 		for dupe_set in duplicate_sets:
 			file_hash = dupe_set['file_hash_hex']
 
-			# Get all file records for this hash
-			file_records = db_session.execute(
-				text("SELECT id FROM public.dim_file WHERE encode(file_hash, 'hex') = :hash"),
-				{"hash": file_hash}
-			).fetchall()
-
 			# Reconstruct the full path for each file
-			filenames = [get_full_path_for_id(db_session, record.id, path_cache) for record in file_records]
+			filenames = [path_map.get(file_id, "") for file_id in ids_by_hash[bytes(dupe_set['file_hash'])]]
 
 			# Create the JSON object and write it to the file as a new line
 			report_line = {
@@ -100,6 +106,11 @@ def scan(
 		"--prune/--no-prune",
 		help="Enable/disable cleaning of non-existent files from the DB before scanning."
 	),
+	bulk: bool = typer.Option(
+		False,
+		"--bulk/--no-bulk",
+		help="Drop secondary indexes during the scan and rebuild them afterwards. Faster for large initial scans."
+	),
 ):
 	"""
 	Scans a directory and populates the File Dimension table in the database.
@@ -115,7 +126,8 @@ def scan(
 		processor.process_directory(
 			db=db_session,
 			root_directory=directory,
-			max_files_override=max_files
+			max_files_override=max_files,
+			bulk=bulk
 		)
 
 	logger.success("Scan completed successfully.")
@@ -2,16 +2,28 @@
 
 import json
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, make_url, text
 from sqlalchemy.orm import Session, sessionmaker
 
 from .config import DATABASE_URL, logger  # Import from our new config module
 
-engine = create_engine(DATABASE_URL)
+# psycopg 3 switches a statement to a server-side prepared statement once it
+# has run prepare_threshold times; 0 prepares on first use, so repeated
+# lookups and batch statements skip parse and plan from the start.
+connect_args = {}
+if make_url(DATABASE_URL).drivername == "postgresql+psycopg":
+	connect_args["prepare_threshold"] = 0
+
+engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- Statements run once per directory, built once at import ---
+_STMT_FIND_ROOT = text("SELECT id FROM public.dim_file WHERE parent_id IS NULL")
+
 
 def ensure_path_exists(db: Session, absolute_path: str, cache: dict) -> int:
 	"""
@@ -26,50 +38,70 @@ def ensure_path_exists(db: Session, absolute_path: str, cache: dict) -> int:
 		raise ValueError("Path must be absolute.")
 
 	# 2. Find the one true root directory. This is the crucial first step.
-	try:
-		root_id = db.execute(
-			text("SELECT id FROM public.dim_file WHERE parent_id IS NULL")
-		).scalar_one()
-		cache['/'] = root_id
-	except Exception as e:
-		logger.critical("Could not find the single root directory '/' in the database.")
-		raise e
-
-	parent_id = root_id
-
-	# 3. Walk the path parts, using the cache as we go
-	for i in range(1, len(path_obj.parts)):
-		current_path_str = str(Path(*path_obj.parts[:i + 1]))
-
-		if current_path_str in cache:
-			parent_id = cache[current_path_str]
-			continue
-
-		part = path_obj.parts[i]
-		child_id_result = db.execute(
-			text("""
-                SELECT id FROM public.dim_file
-                WHERE parent_id = :parent_id AND file_name = :name AND is_directory = TRUE
-            """),
-			{"parent_id": parent_id, "name": part}
-		).scalar_one_or_none()
-
-		if child_id_result:
-			parent_id = child_id_result
+	root_id = cache.get('/')
+	if root_id is None:
+		try:
+			root_id = db.execute(_STMT_FIND_ROOT).scalar_one()
+			cache['/'] = root_id
+		except Exception as e:
+			logger.critical("Could not find the single root directory '/' in the database.")
+			raise e
+
+	# 3. Find the deepest ancestor that's already cached
+	parts = path_obj.parts
+	prefixes = [str(Path(*parts[:i + 1])) for i in range(len(parts))]
+	depth = len(parts) - 1
+	while prefixes[depth] not in cache:
+		depth -= 1
+
+	# 4. Look up or create everything below it in a single round-trip
+	missing_ids = _ensure_directory_chain(db, cache[prefixes[depth]], parts[depth + 1:])
+	for prefix, dir_id in zip(prefixes[depth + 1:], missing_ids):
+		cache[prefix] = dir_id
+
+	return cache[prefixes[-1]]
+
+
+def _ensure_directory_chain(db: Session, parent_id: int, names: tuple[str, ...]) -> list[int]:
+	"""
+	Looks up or inserts a chain of nested directories under parent_id with one
+	statement, returning their IDs from the top down.
+
+	Each level is a data-modifying CTE that inserts the directory under the ID
+	returned by the level above. ON CONFLICT ... DO UPDATE makes existing
+	directories return their ID too. A file row with the same name (a file
+	that has since been replaced by a directory) is turned into a directory
+	and its file attributes are cleared.
+	"""
+	if not names:
+		return []
+
+	params = {"parent_id": parent_id}
+	levels = []
+	for level, name in enumerate(names):
+		params[f"name_{level}"] = name
+		if level == 0:
+			source = f"SELECT CAST(:parent_id AS bigint), CAST(:name_{level} AS text), TRUE"
 		else:
-			new_id_result = db.execute(
-				text("""
-                    INSERT INTO public.dim_file (parent_id, file_name, is_directory)
-                    VALUES (:parent_id, :name, TRUE)
-                    RETURNING id
-                """),
-				{"parent_id": parent_id, "name": part}
-			).scalar_one()
-			parent_id = new_id_result
-
-		cache[current_path_str] = parent_id
-
-	return parent_id
+			source = f"SELECT id, CAST(:name_{level} AS text), TRUE FROM level_{level - 1}"
+		levels.append(f"""
+            level_{level} AS (
+                INSERT INTO public.dim_file (parent_id, file_name, is_directory)
+                {source}
+                ON CONFLICT (parent_id, file_name) DO UPDATE SET
+                    is_directory = TRUE,
+                    file_hash = NULL, head_hash = NULL, hash_type = NULL,
+                    file_size = NULL, device_id = NULL, inode = NULL,
+                    modified_at = NULL, mimetype = NULL
+                RETURNING id
+            )""")
+
+	columns = ", ".join(f"(SELECT id FROM level_{level})" for level in range(len(names)))
+	row = db.execute(
+		text(f"WITH {','.join(levels)}\nSELECT {columns}"),
+		params
+	).one()
+	return list(row)
 
 
 def find_duplicate_sets(db: Session, limit: int = 25) -> list:
@@ -81,11 +113,12 @@ def find_duplicate_sets(db: Session, limit: int = 25) -> list:
 		limit: The maximum number of duplicate sets to return.
 
 	Returns:
-		A list of rows, each containing the hash, count, and total size.
+		A list of rows, each containing the raw and hex hash, count, and total size.
 	"""
 	logger.info(f"Querying for top {limit} duplicate file sets...")
 	query = text("""
         SELECT
+            file_hash,
             encode(file_hash, 'hex') as file_hash_hex,
             COUNT(*) AS duplicate_count,
             SUM(file_size) AS total_wasted_space
@@ -107,28 +140,40 @@ def find_duplicate_sets(db: Session, limit: int = 25) -> list:
 	return result.mappings().all()
 
 
-def get_full_path_for_id(db: Session, file_id: int, cache: dict) -> str:
-	"""Recursively builds the full path for a given file ID, using a cache."""
-	if file_id in cache:
-		return cache[file_id]
-
-	row = db.execute(
-		text("SELECT parent_id, file_name FROM public.dim_file WHERE id = :file_id"),
-		{"file_id": file_id}
-	).first()
-
-	if row is None:
-		return ""
+def get_full_paths_bulk(db: Session, ids: list[int]) -> dict[int, str]:
+	"""
+	Builds the full paths for many file IDs in a single round-trip.
 
-	if row.parent_id is None:  # This is the root
-		path = "/"
-	else:
-		# Recursively get the parent path and append this file's name
-		parent_path = get_full_path_for_id(db, row.parent_id, cache)
-		path = str(Path(parent_path) / row.file_name)
+	A recursive CTE walks from each requested ID up to the root, and the
+	names along each chain are aggregated into a path server-side.
+	"""
+	if not ids:
+		return {}
 
-	cache[file_id] = path
-	return path
+	rows = db.execute(
+		text("""
+            WITH RECURSIVE ancestors AS (
+                SELECT id, parent_id, file_name, id AS leaf, 0 AS depth
+                FROM public.dim_file
+                WHERE id = ANY(:ids)
+              UNION ALL
+                SELECT p.id, p.parent_id, p.file_name, a.leaf, a.depth + 1
+                FROM public.dim_file p
+                JOIN ancestors a ON p.id = a.parent_id
+            )
+            SELECT
+                leaf,
+                '/' || COALESCE(
+                    string_agg(file_name, '/' ORDER BY depth DESC)
+                        FILTER (WHERE parent_id IS NOT NULL),
+                    ''
+                ) AS full_path
+            FROM ancestors
+            GROUP BY leaf
+        """),
+		{"ids": list(ids)}
+	).fetchall()
+	return {row.leaf: row.full_path for row in rows}
 
 
 def initialize_database_old(session):
@@ -150,33 +195,169 @@ def initialize_database_old(session):
 # For now, this will work as long as only one entry has a NULL parent.
 
 
-def prune_database(db: Session):
+def load_path_map(db: Session, directories_only: bool = False) -> dict[int, str]:
+	"""
+	Builds a map of every record ID to its full path with a single query.
+	"""
+	query = "SELECT id, parent_id, file_name FROM public.dim_file"
+	if directories_only:
+		query += " WHERE is_directory = TRUE"
+	return _build_path_map(db.execute(text(query)).fetchall())
+
+
+def _build_path_map(rows) -> dict[int, str]:
+	"""
+	Assembles full paths from (id, parent_id, file_name) rows in Python,
+	walking up each chain iteratively and caching every intermediate parent
+	so that each ID is resolved only once. Records whose ancestry doesn't
+	reach the root are left out.
+	"""
+	nodes = {row.id: (row.parent_id, row.file_name) for row in rows}
+
+	paths = {}
+	for file_id in nodes:
+		# Walk up until we hit a resolved ancestor (or the root)
+		chain = []
+		current = file_id
+		while current not in paths and current in nodes:
+			chain.append(current)
+			current = nodes[current][0]
+
+		# An orphan chain (its top parent isn't in the rows) has no full path
+		if current is not None and current not in paths:
+			continue
+
+		parent_path = paths.get(current, "")
+		# Unwind the chain from the top-most unresolved ancestor downwards
+		for node_id in reversed(chain):
+			parent_id, file_name = nodes[node_id]
+			if parent_id is None:  # This is the root
+				parent_path = "/"
+			else:
+				parent_path = os.path.join(parent_path, file_name)
+			paths[node_id] = parent_path
+
+	return paths
+
+
+def preload_path_cache(db: Session, cache: dict):
+	"""
+	Fills an ensure_path_exists() cache with every known directory, so a
+	scan does no lookups at all for directories that are already stored.
+	"""
+	directory_paths = load_path_map(db, directories_only=True)
+	cache.update((path, dir_id) for dir_id, path in directory_paths.items())
+	logger.info(f"Preloaded {len(directory_paths):,d} directories into the path cache.")
+
+
+def begin_bulk_load(db: Session) -> list:
+	"""
+	Prepares dim_file for a large load by dropping its secondary indexes and
+	turning off synchronous commit for this session.
+
+	Unique indexes are kept, since the scan's ON CONFLICT upserts and the
+	single-root rule depend on them. The definitions of the dropped indexes
+	are returned so end_bulk_load() can rebuild them exactly as they were.
+	"""
+	indexes = db.execute(
+		text("""
+            SELECT
+                c.relname AS index_name,
+                pg_get_indexdef(i.indexrelid) AS index_def,
+                -- COMMENT takes no bind parameters, so quote the comment here
+                format(
+                    'COMMENT ON INDEX public.%I IS %L',
+                    c.relname, obj_description(i.indexrelid, 'pg_class')
+                ) AS comment_sql,
+                obj_description(i.indexrelid, 'pg_class') IS NOT NULL AS has_comment
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = 'public.dim_file'::regclass
+              AND NOT i.indisunique
+        """)
+	).fetchall()
+
+	logger.info(f"Bulk load: dropping {len(indexes)} secondary indexes on dim_file...")
+	for index in indexes:
+		# Logged so an index can be recreated by hand if the rebuild never runs
+		logger.info(f"Bulk load: dropping {index.index_def}")
+		db.execute(text(f'DROP INDEX IF EXISTS public."{index.index_name}"'))
+	db.execute(text("SET synchronous_commit = off"))
+	db.commit()
+	return indexes
+
+
+def end_bulk_load(db: Session, indexes: list):
+	"""
+	Rebuilds the indexes dropped by begin_bulk_load(), restores synchronous
+	commit and refreshes the planner statistics for dim_file.
+	"""
+	logger.info(f"Bulk load: rebuilding {len(indexes)} secondary indexes on dim_file...")
+	db.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+	for index in indexes:
+		# IF NOT EXISTS covers a failed load whose DROPs were rolled back
+		db.execute(text(index.index_def.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1)))
+		if index.has_comment:
+			# Run as-is on the driver cursor; text() would read ':' in the
+			# comment as a bind parameter
+			with db.connection().connection.driver_connection.cursor() as cursor:
+				cursor.execute(index.comment_sql)
+	db.execute(text("RESET synchronous_commit"))
+	db.execute(text("ANALYZE public.dim_file"))
+	db.commit()
+
+
+def _check_paths_exist(file_paths: list[tuple[int, str]], max_workers: int):
+	"""
+	Yields (file_id, full_path, exists) for each pair, in order.
+
+	Existence checks are I/O-bound, so the stat() calls are spread over
+	threads. As in processor.hash_files(), at most 2 * max_workers checks
+	are queued ahead of the consumer, so a table with millions of rows
+	doesn't mean millions of pending futures.
+	"""
+	pending = deque()
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		for file_id, full_path in file_paths:
+			pending.append((file_id, full_path, executor.submit(os.path.exists, full_path)))
+			if len(pending) >= 2 * max_workers:
+				file_id, full_path, future = pending.popleft()
+				yield file_id, full_path, future.result()
+		while pending:
+			file_id, full_path, future = pending.popleft()
+			yield file_id, full_path, future.result()
+
+
+def prune_database(db: Session, max_workers: int = 32):
 	"""
 	Scans all file records in the database and removes any that no longer
 	exist on the filesystem.
 	"""
 	logger.info("Starting pre-scan database prune...")
 
-	# A cache is essential for performance here
-	path_cache = {}
-
-	# Get all records that are files, not directories
-	all_files = db.execute(
-		text("SELECT id FROM public.dim_file WHERE is_directory = FALSE")
+	# Resolve every path in one round-trip rather than one query per ancestor,
+	# and pick the files (not directories) out of the same rows
+	all_records = db.execute(
+		text("SELECT id, parent_id, file_name, is_directory FROM public.dim_file")
 	).fetchall()
-
-	ids_to_delete = []
-	total_files = len(all_files)
+	path_map = _build_path_map(all_records)
+	file_paths = [
+		(record.id, path_map[record.id])
+		for record in all_records
+		if not record.is_directory and record.id in path_map
+	]
+
+	total_files = len(file_paths)
 	logger.info(f"Verifying existence of {total_files} file records...")
 
-	for i, file_record in enumerate(all_files):
+	ids_to_delete = []
+	for i, (file_id, full_path, exists) in enumerate(_check_paths_exist(file_paths, max_workers)):
 		if (i + 1) % 1000 == 0:
 			logger.info(f"Checked {i + 1}/{total_files} files...")
 
-		full_path = get_full_path_for_id(db, file_record.id, path_cache)
-		if not os.path.exists(full_path):
+		if not exists:
 			logger.warning(f"File not found, marking for deletion: {full_path}")
-			ids_to_delete.append(file_record.id)
+			ids_to_delete.append(file_id)
 
 	if not ids_to_delete:
 		logger.success("Prune complete. No missing files found.")
@@ -191,6 +372,3 @@ def prune_database(db: Session):
 	)
 	db.commit()
 	logger.success(f"Successfully deleted {len(ids_to_delete)} records.")
-
-
-
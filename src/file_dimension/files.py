@@ -3,18 +3,81 @@
 import hashlib
 import mimetypes
 import os
-from datetime import datetime
-from typing import Iterator, Dict, Any
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterator
 
 import magic
 
+# Content hash stored in dim_file.file_hash (48 bytes for SHA-384).
+# Changing this requires rehashing every row, so it is not a runtime option.
+HASH_ALGORITHM = "sha384"
+
+# Only the first HEAD_HASH_SIZE bytes are hashed on the first pass. Files no
+# larger than this are fully covered by their head hash.
+HEAD_HASH_SIZE = 1024 * 1024
+
+# Load the system MIME type tables and the libmagic database once, at import
+mimetypes.init()
+_MAGIC = magic.Magic(mime=True)
+
+
+@dataclass(slots=True)
+class FileInfo:
+	"""
+	Metadata for one scanned file, as yielded by find_files(). Slots keep
+	each instance small and make field access a fixed-offset lookup.
+	"""
+	full_path: str
+	parent_path: str
+	file_name: str
+	file_size: int
+	mimetype: str | None
+	modified_at: datetime
+	mtime_ts: float  # The raw float, for comparison
+	device_id: int
+	inode: int
+
+
+def file_extension(file_name: str) -> str:
+	"""
+	Returns the part of a file name that mimetypes.guess_type() looks at:
+	the last suffix, plus the one before it when the last is an encoding
+	(e.g. '.tar.gz'). Other dots in a name, as in 'app.3f9a1c.js', are
+	ignored so they don't each make a new cache key.
+	"""
+	stem, extension = os.path.splitext(file_name)
+	# Same check as guess_type(): '.Z' only matches case-sensitively
+	if extension in mimetypes.encodings_map or extension.lower() in mimetypes.encodings_map:
+		return os.path.splitext(stem)[1] + extension
+	return extension
+
+
+# Extension -> MIME type (or None), filled in as extensions are seen. Names
+# like 'log.2024-01-01' still have unique suffixes, so the cache stops
+# growing at _MIME_CACHE_SIZE entries; later extensions are looked up uncached.
+_MIME_CACHE_SIZE = 4096
+_MIME_CACHE: dict[str, str | None] = {"": None}
+
+
+def guess_type_by_extension(extension: str) -> str | None:
+	"""Guesses a MIME type from a file extension, caching the result."""
+	try:
+		return _MIME_CACHE[extension]
+	except KeyError:
+		detected_mimetype, _ = mimetypes.guess_type(f"x{extension}")
+		if len(_MIME_CACHE) < _MIME_CACHE_SIZE:
+			_MIME_CACHE[extension] = detected_mimetype
+		return detected_mimetype
+
 
 def get_magic_mime_type(filename: os.PathLike) -> str | None:
 	"""Gets the MIME type by reading the file's magic numbers."""
 	try:
 		with open(filename, "rb") as fp:
 			buffer = fp.read(2048)
-			return magic.from_buffer(buffer, mime=True)
+			return _MAGIC.from_buffer(buffer)
 	except FileNotFoundError:
 		return None
 
@@ -25,22 +88,39 @@ def find_files(
 	since_dt: datetime | None = None,
 	until_dt: datetime | None = None,
 	min_size: int | None = None,
-) -> Iterator[Dict[str, Any]]:
+) -> Iterator[FileInfo]:
 	"""
 	Scans a directory tree and yields timezone-aware metadata for files
 	that match the criteria.
 	"""
-	mimetypes.init()
-
 	since_ts = since_dt.timestamp() if since_dt else None
 	until_ts = until_dt.timestamp() if until_dt else None
 
-	for dirpath, _, filenames in os.walk(root_directory):
-		for filename in filenames:
-			full_path = os.path.join(dirpath, filename)
+	# Walk the tree with os.scandir directly, depth-first, yielding each
+	# directory's files before descending into its subdirectories.
+	directories = [root_directory]
+	while directories:
+		dirpath = directories.pop()
+		try:
+			with os.scandir(dirpath) as it:
+				entries = list(it)
+		except OSError:
+			# Unreadable directories are skipped, as os.walk() does
+			continue
+
+		subdirectories = []
+		for entry in entries:
+			full_path = entry.path
 
 			try:
-				stats = os.stat(full_path)
+				# d_type from readdir answers this without a stat() call.
+				# Symlinked directories are not followed, as with os.walk().
+				if entry.is_dir():
+					if not entry.is_symlink():
+						subdirectories.append(full_path)
+					continue
+
+				stats = entry.stat()
 				file_mtime_ts = stats.st_mtime
 
 				# Filter Logic
@@ -51,7 +131,8 @@ def find_files(
 				if until_ts is not None and file_mtime_ts > until_ts:
 					continue
 
-				detected_mimetype, _ = mimetypes.guess_type(full_path)
+				# Only read the file's magic numbers when the extension is no help
+				detected_mimetype = guess_type_by_extension(file_extension(entry.name))
 				if detected_mimetype is None:
 					detected_mimetype = get_magic_mime_type(full_path)
 
@@ -59,17 +140,19 @@ def find_files(
 					continue
 
 				# --- Yield Timezone-Aware Metadata ---
-				yield {
-					"full_path": full_path,
-					"file_name": filename,
-					"parent_path": dirpath,
-					"file_size": stats.st_size,
-					"mimetype": detected_mimetype,
-					"modified_at": datetime.fromtimestamp(file_mtime_ts).astimezone(),
-					"mtime_ts": file_mtime_ts,  # The raw float, for comparison
-					"device_id": stats.st_dev,
-					"inode": stats.st_ino,
-				}
+				yield FileInfo(
+					full_path=full_path,
+					parent_path=dirpath,
+					file_name=entry.name,
+					file_size=stats.st_size,
+					mimetype=detected_mimetype,
+					# One UTC conversion; astimezone() would do a second, local-time one.
+					# timestamptz stores the same instant either way.
+					modified_at=datetime.fromtimestamp(file_mtime_ts, timezone.utc),
+					mtime_ts=file_mtime_ts,
+					device_id=stats.st_dev,
+					inode=stats.st_ino,
+				)
 
 			except FileNotFoundError:
 				continue
@@ -77,16 +160,55 @@ def find_files(
 				print(f"Error processing {full_path}: {e}")
 				continue
 
+		# Push in reverse so subdirectories are visited in listing order
+		directories.extend(reversed(subdirectories))
 
-def calculate_sha384(file_path: str) -> str | None:
-	"""Calculates the SHA-384 hash of a file."""
-	sha384_hash = hashlib.sha384()
+
+def calculate_sha384(file_path: str) -> bytes | None:
+	"""Calculates the raw 48-byte SHA-384 digest of a file."""
 	try:
 		with open(file_path, "rb") as f:
-			# Read the file in chunks to handle large files efficiently
-			for chunk in iter(lambda: f.read(4096), b""):
-				sha384_hash.update(chunk)
-		return sha384_hash.hexdigest()
+			# Tell the kernel we'll read front to back so it reads ahead aggressively
+			if hasattr(os, "posix_fadvise"):
+				os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+			# file_digest() runs the read/update loop in C, without the GIL.
+			# Files are not mmap'd: if one is truncated while it's being read
+			# (e.g. a log rotated with copytruncate), touching the lost pages
+			# raises SIGBUS and kills the process; read() just stops short.
+			sha384_hash = hashlib.file_digest(f, HASH_ALGORITHM)
+		return sha384_hash.digest()
 	except (FileNotFoundError, IsADirectoryError):
 		return None
 
+
+# Each hashing thread reuses one read buffer for head hashes
+_thread_local = threading.local()
+
+
+def _read_buffer(size: int) -> memoryview:
+	"""Returns this thread's reusable read buffer, at least `size` bytes long."""
+	buffer = getattr(_thread_local, "buffer", None)
+	if buffer is None or len(buffer) < size:
+		buffer = _thread_local.buffer = memoryview(bytearray(size))
+	return buffer
+
+
+def calculate_head_hash(file_path: str, size: int = HEAD_HASH_SIZE) -> bytes | None:
+	"""Calculates the raw SHA-384 digest of the first `size` bytes of a file."""
+	head_hash = hashlib.new(HASH_ALGORITHM)
+	buffer = _read_buffer(size)
+	try:
+		# Read straight into the preallocated buffer rather than allocating a
+		# fresh 1 MiB bytes object for every file
+		with open(file_path, "rb", buffering=0) as f:
+			filled = 0
+			while filled < size:
+				n = f.readinto(buffer[filled:size])
+				if not n:
+					break
+				filled += n
+		head_hash.update(buffer[:filled])
+		return head_hash.digest()
+	except (FileNotFoundError, IsADirectoryError):
+		return None
@@ -1,129 +1,367 @@
 # src/file_dimension/processor.py
 
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from .config import logger  # , MAX_FILES
-from .database import ensure_path_exists  # , initialize_database
-from .files import find_files, calculate_sha384
+from .database import begin_bulk_load, end_bulk_load, ensure_path_exists, get_full_paths_bulk, preload_path_cache  # , initialize_database
+from .files import FileInfo, find_files, calculate_sha384, calculate_head_hash, HEAD_HASH_SIZE
+
+# Number of file rows written per batched UPSERT
+UPSERT_BATCH_SIZE = 5000
+
+# Default size of the hashing thread pool. A few more workers than CPUs keep
+# reads queued at the disk while every core is busy hashing.
+HASH_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Columns of a scanned file row and their PostgreSQL types, in the order
+# they are sent with COPY
+FILE_COLUMNS = {
+	"parent_id": "bigint",
+	"file_name": "text",
+	"file_hash": "bytea",
+	"head_hash": "bytea",
+	"hash_type": "text",
+	"file_size": "bigint",
+	"device_id": "bigint",
+	"inode": "bigint",
+	"modified_at": "timestamptz",
+	"mimetype": "text",
+}
+
+# --- Statements run once per batch or file, built once at import ---
+_STMT_CREATE_STAGING = text(
+	"CREATE TEMP TABLE IF NOT EXISTS dim_file_staging ("
+	+ ", ".join(f"{column} {pg_type}" for column, pg_type in FILE_COLUMNS.items())
+	+ ") ON COMMIT DELETE ROWS"
+)
+
+_STMT_TRUNCATE_STAGING = text("TRUNCATE dim_file_staging")
+
+_COPY_STAGING = f"COPY dim_file_staging ({', '.join(FILE_COLUMNS)}) FROM STDIN (FORMAT BINARY)"
+
+_STMT_MERGE_STAGING = text("""
+	INSERT INTO public.dim_file (
+		parent_id, file_name, is_directory, file_hash, head_hash, hash_type,
+		file_size, device_id, inode, modified_at, mimetype
+	)
+	SELECT
+		parent_id, file_name, FALSE, file_hash, head_hash, hash_type,
+		file_size, device_id, inode, modified_at, mimetype
+	FROM dim_file_staging
+	ON CONFLICT (parent_id, file_name) DO UPDATE SET
+		file_hash = EXCLUDED.file_hash,
+		head_hash = EXCLUDED.head_hash,
+		hash_type = EXCLUDED.hash_type,
+		file_size = EXCLUDED.file_size,
+		modified_at = EXCLUDED.modified_at,
+		mimetype = EXCLUDED.mimetype,
+		inode = EXCLUDED.inode,
+		device_id = EXCLUDED.device_id
+	-- Matches the skip key in changed_files(), plus the head hash, so a file
+	-- that was rehashed is always written back
+	WHERE dim_file.head_hash IS DISTINCT FROM EXCLUDED.head_hash
+	   OR dim_file.file_size IS DISTINCT FROM EXCLUDED.file_size
+	   OR dim_file.device_id IS DISTINCT FROM EXCLUDED.device_id
+	   OR dim_file.inode IS DISTINCT FROM EXCLUDED.inode
+	   OR date_trunc('second', dim_file.modified_at)
+		  IS DISTINCT FROM date_trunc('second', EXCLUDED.modified_at)
+	-- xmax is 0 only on freshly inserted row versions
+	RETURNING (xmax = 0) AS inserted
+""")
+
+_STMT_FIND_EXISTING = text("""
+	SELECT f.parent_id, f.file_name, f.file_size, f.device_id, f.inode,
+		trunc(extract(epoch FROM f.modified_at))::bigint AS mtime_s
+	FROM public.dim_file f
+	JOIN unnest(CAST(:parent_ids AS bigint[]), CAST(:file_names AS text[]))
+		AS k(parent_id, file_name)
+		ON f.parent_id = k.parent_id AND f.file_name = k.file_name
+	WHERE f.is_directory = FALSE
+	  -- Rows from before two-tier hashing have no hash_type (and no head_hash)
+	  -- and must be rehashed; every scanned row sets both together
+	  AND f.hash_type IS NOT NULL AND f.modified_at IS NOT NULL
+""")
+
+# Only files larger than the head hash can be candidates; smaller ones were
+# hashed in full on the first pass. Hard links to one file count once, as in
+# find_duplicate_sets(), so they are never read in full for nothing.
+_STMT_FIND_CANDIDATES = text("""
+	SELECT id FROM public.dim_file
+	WHERE hash_type = 'head'
+	  AND file_size > :head_hash_size
+	  AND (file_size, head_hash) IN (
+		SELECT file_size, head_hash FROM public.dim_file
+		WHERE head_hash IS NOT NULL
+		  AND file_size > :head_hash_size
+		GROUP BY file_size, head_hash
+		HAVING COUNT(DISTINCT (device_id, inode)) > 1
+	  )
+""")
+
+_STMT_SET_FULL_HASHES = text("""
+	UPDATE public.dim_file AS f SET
+		file_hash = u.file_hash,
+		hash_type = 'full'
+	FROM unnest(CAST(:file_ids AS bigint[]), CAST(:file_hashes AS bytea[]))
+		AS u(id, file_hash)
+	WHERE f.id = u.id
+""")
+
+
+def upsert_files(db: Session, rows: list[tuple]) -> tuple[int, int]:
+	"""
+	Inserts a batch of file rows (tuples in FILE_COLUMNS order), or updates
+	the existing rows for the same (parent_id, file_name) when their head hash,
+	size, device, inode or modification time changed.
+	Unchanged rows are left alone, so their updated_at is not touched.
+
+	The rows are streamed into a temporary staging table with a binary
+	COPY FROM STDIN and merged into dim_file with a single INSERT ... ON CONFLICT.
+
+	Returns:
+		A tuple of (inserted, updated) row counts.
+	"""
+	if not rows:
+		return 0, 0
+
+	db.execute(_STMT_CREATE_STAGING)
+	db.execute(_STMT_TRUNCATE_STAGING)
+
+	# COPY isn't exposed by SQLAlchemy, so use the session's psycopg connection
+	dbapi_connection = db.connection().connection.driver_connection
+	with dbapi_connection.cursor() as cursor:
+		with cursor.copy(_COPY_STAGING) as copy:
+			# Binary COPY sends values as-is, so the server doesn't parse any text
+			copy.set_types(list(FILE_COLUMNS.values()))
+			for row in rows:
+				copy.write_row(row)
+
+	inserted_flags = db.execute(_STMT_MERGE_STAGING).scalars().all()
+	inserted = sum(inserted_flags)
+	return inserted, len(inserted_flags) - inserted
+
+
+# Number of scanned files whose existing rows are looked up per query
+LOOKUP_BATCH_SIZE = 500
+
+
+def changed_files(db: Session, file_generator, path_cache: dict):
+	"""
+	Resolves each file's parent directory and yields (parent_id, info)
+	for files that are new or have changed since the last scan.
+
+	A file whose size, device, inode and modification time (to the second)
+	all match its existing row is skipped before it is ever read. Files are
+	taken in batches, and the existing rows for a whole batch are fetched
+	with one query keyed on (parent_id, file_name).
+	"""
+	file_iterator = iter(file_generator)
+	i = 0
+	parent_path = parent_id = None
+	while batch := list(islice(file_iterator, LOOKUP_BATCH_SIZE)):
+		parent_ids = []
+		for info in batch:
+			# Only show the first 25 files, and then every 100th
+			if i < 25 or i % 100 == 99:
+				logger.info(f"Processing ({i + 1:,d}): {info.full_path}")
+			i += 1
+
+			# Ensure the parent directory exists in the DB and get its ID.
+			# find_files hands every file in a directory the same parent_path
+			# object, so an identity check skips hashing the path string.
+			if info.parent_path is not parent_path:
+				parent_path = info.parent_path
+				parent_id = ensure_path_exists(db, parent_path, path_cache)
+			parent_ids.append(parent_id)
+
+		# Each row is reduced to one (size, device, inode, mtime seconds) tuple,
+		# with the epoch conversion done by the database, so checking a
+		# file below is a single tuple comparison.
+		existing_files = {
+			(row.parent_id, row.file_name): (row.file_size, row.device_id, row.inode, row.mtime_s)
+			for row in db.execute(
+				_STMT_FIND_EXISTING,
+				{"parent_ids": parent_ids, "file_names": [info.file_name for info in batch]}
+			)
+		}
+
+		for parent_id, info in zip(parent_ids, batch):
+			file_key = (info.file_size, info.device_id, info.inode, int(info.mtime_ts))
+			if existing_files.get((parent_id, info.file_name)) == file_key:
+				# Pass the name as an argument so it's only formatted if DEBUG is on
+				logger.debug("Skipping unchanged file: {}", info.file_name)
+				continue
+
+			yield parent_id, info
+
+
+def hash_file(parent_id: int, info: FileInfo) -> tuple[int, FileInfo, bytes | None, bytes | None, str]:
+	"""
+	Calculates the hashes for one file. Small files are covered entirely by
+	their head hash; larger ones only get a full hash later, if they might
+	be a duplicate.
+
+	Returns:
+		A tuple of (parent_id, info, file_hash, head_hash, hash_type).
+	"""
+	if info.file_size <= HEAD_HASH_SIZE:
+		file_hash = calculate_sha384(info.full_path)
+		return parent_id, info, file_hash, file_hash, "full"
+	return parent_id, info, None, calculate_head_hash(info.full_path), "head"
+
+
+def hash_files(files, max_workers: int | None = None):
+	"""
+	Hashes (parent_id, info) pairs on a pool of worker threads while
+	preserving their order.
+
+	Reading and hashing both release the GIL (hashlib drops it while digesting
+	large buffers), so threads hash on every core at once, just as a process
+	pool would, but without pickling results or re-importing the app per
+	worker. At most 2 * max_workers files are queued ahead of the consumer,
+	which keeps memory bounded on large scans.
+	"""
+	max_workers = max_workers or HASH_WORKERS
+	pending = deque()
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		for parent_id, info in files:
+			pending.append(executor.submit(hash_file, parent_id, info))
+			if len(pending) >= 2 * max_workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
 
 
 # Use logger.catch for clean exception handling
 @logger.catch
-def process_directory(db: Session, root_directory: str, max_files_override: int):
+def process_directory(db: Session, root_directory: str, max_files_override: int, bulk: bool = False):
 	"""
 	Scans a directory and populates the file dimension table, processing
 	up to a maximum number of files defined by the MAX_FILES env variable.
+
+	With bulk=True, the secondary indexes on dim_file are dropped for the
+	duration of the load and rebuilt afterwards, which is much faster for
+	large initial scans.
 	"""
 	max_files = max_files_override
+	dropped_indexes = []
 
 	# with SessionLocal() as session:
 	try:
 		# logger.info(f"Initializing database . . .")
 		# initialize_database(db)
 
-		# Create a cache for this run to store resolved directory IDs
+		if bulk:
+			dropped_indexes = begin_bulk_load(db)
+
+		# Create a cache for this run to store resolved directory IDs, and
+		# warm it with every directory already in the database
 		path_cache = {}
+		preload_path_cache(db, path_cache)
+		# Rows waiting for the next batched UPSERT, and running totals
+		pending = []
+		inserted = updated = 0
 
 		file_generator = find_files(root_directory=root_directory)
+		# Apply the limit before hashing so no extra files are read
+		if max_files > 0:
+			file_generator = islice(file_generator, max_files)
 
 		logger.info(f"Starting processing. Max files to process: {max_files if max_files > 0 else 'All'}")
 
 		# --- Main Processing Loop with MAX_FILES limit ---
-		for i, info_dict in enumerate(file_generator):
-			# Your break logic
-			if max_files > 0 and i >= max_files:
-				logger.info(f"Reached MAX_FILES limit of {max_files}. Stopping.")
-				break
+		# 1. Resolve parent directories and drop unchanged files (changed_files)
+		# 2. Hash what's left on the worker pool (hash_files)
+		files_to_hash = changed_files(db, file_generator, path_cache)
+		for parent_id, info, file_hash, head_hash, hash_type in hash_files(files_to_hash):
+			# 3. Queue the row as a tuple in FILE_COLUMNS order, ready for COPY
+			pending.append((
+				parent_id,
+				info.file_name,
+				file_hash,
+				head_hash,
+				hash_type,
+				info.file_size,
+				info.device_id,
+				info.inode,
+				info.modified_at,
+				info.mimetype,
+			))
 
-			# Only show the first 25 files, and then every 100th
-			if i < 25 or i % 100 == 99:
-				logger.info(f"Processing ({i + 1:,d}): {info_dict['full_path']}")
-
-			# 1. Ensure the parent directory exists in the DB and get its ID
-			# parent_id = ensure_path_exists(db, info_dict['parent_path'])
-			# Pass the cache to the function
-			parent_id = ensure_path_exists(db, info_dict['parent_path'], path_cache)
-
-			# 2. Calculate the file's hash
-			file_hash = calculate_sha384(info_dict['full_path'])
-			# logger.info(f"file_hash -> {file_hash}")
-
-			# 3. Check if the file record already exists
-			existing_file = db.execute(
-				text("""
-								SELECT id, file_hash, modified_at FROM public.dim_file
-								WHERE parent_id = :parent_id AND file_name = :file_name
-							"""),
-				{"parent_id": parent_id, "file_name": info_dict['file_name']}
-			).first()
-
-			# 4. INSERT or UPDATE logic
-			if existing_file is None:
-				# INSERT new record
-				logger.debug(f"INSERTING new record for {info_dict['file_name']}")
-				db.execute(
-					text("""
-									INSERT INTO public.dim_file (
-										parent_id, file_name, is_directory, file_hash, file_size,
-										device_id, inode, modified_at, mimetype
-									) VALUES (
-										:parent_id, :file_name, FALSE, :file_hash, :file_size,
-										:device_id, :inode, :modified_at, :mimetype
-									)
-								"""),
-					{
-						"parent_id": parent_id,
-						"file_name": info_dict['file_name'],
-						"file_hash": file_hash,
-						"file_size": info_dict['file_size'],
-						"device_id": info_dict['device_id'],
-						"inode": info_dict['inode'],
-						"modified_at": info_dict['modified_at'],
-						"mimetype": info_dict['mimetype']
-					}
-				)
-			else:
-				# UPDATE existing record if necessary (e.g., if hash or mtime changed)
-				# Convert the database's datetime back to a float timestamp for a reliable comparison
-				existing_mtime_ts = existing_file.modified_at.timestamp()
-
-				logger.debug(f"modified_at: {existing_file.modified_at} vs {info_dict['modified_at']}")
-				logger.debug(f"mtime   : {existing_mtime_ts} vs {info_dict['mtime_ts']}")
-				logger.debug(f"hash    : {existing_file.file_hash.decode()} vs {file_hash}")
-				# Compare the raw float timestamps
-				if (existing_file.file_hash.decode() != file_hash or
-					int(existing_mtime_ts) != int(info_dict['mtime_ts'])):
-
-					logger.debug(f"UPDATING record for {info_dict['file_name']}")
-					db.execute(
-						text("""
-							UPDATE public.dim_file SET
-								file_hash = :file_hash,
-								file_size = :file_size,
-								modified_at = :modified_at,
-								mimetype = :mimetype,
-								inode = :inode,
-								device_id = :device_id
-							WHERE id = :file_id
-						"""),
-						{
-							"file_hash": file_hash,
-							"file_size": info_dict['file_size'],
-							"modified_at": info_dict['modified_at'],  # Still insert the datetime object
-							"mimetype": info_dict['mimetype'],
-							"inode": info_dict['inode'],
-							"device_id": info_dict['device_id'],
-							"file_id": existing_file.id
-						}
-					)
-				else:
-					logger.debug(f"Skipping unchanged file: {info_dict['file_name']}")
-			if i % 250 == 0:
+			# 4. INSERT or UPDATE the batch in one go
+			if len(pending) >= UPSERT_BATCH_SIZE:
+				batch_inserted, batch_updated = upsert_files(db, pending)
+				inserted += batch_inserted
+				updated += batch_updated
+				pending.clear()
 				db.commit()
+		batch_inserted, batch_updated = upsert_files(db, pending)
+		inserted += batch_inserted
+		updated += batch_updated
+		db.commit()
+		logger.info(f"Inserted {inserted:,d} and updated {updated:,d} file records.")
+
+		if dropped_indexes:
+			end_bulk_load(db, dropped_indexes)
+			dropped_indexes = []
+
+		# 5. Fully hash the large files that share a size and head hash
+		hash_duplicate_candidates(db)
 		db.commit()
 		logger.success("Processing complete. Changes committed.")
 	except Exception as e:
 		logger.critical(f"An error occurred: {e}")
 		db.rollback()  # Roll back the passed-in session
 		raise  # Re-raise the exception so the caller knows something went wrong
+	finally:
+		# Never leave dim_file without its indexes, even after a failed load.
+		# Roll back first: after KeyboardInterrupt the except above never ran,
+		# and the transaction may be mid-COPY.
+		if dropped_indexes:
+			db.rollback()
+			end_bulk_load(db, dropped_indexes)
+
+
+def hash_duplicate_candidates(db: Session, max_workers: int | None = None):
+	"""
+	Computes the full hash for files that only have a head hash and share
+	their (file_size, head_hash) with at least one other file (not just a
+	hard link to the same one). Files that are unique by size and head hash
+	can't be duplicates, so they are never read in full.
+
+	These are the largest reads of a scan, so they run on a thread pool like
+	hash_files(), and the results are written back in batches.
+	"""
+	candidate_ids = db.execute(
+		_STMT_FIND_CANDIDATES,
+		{"head_hash_size": HEAD_HASH_SIZE}
+	).scalars().all()
+
+	if not candidate_ids:
+		return
+
+	logger.info(f"Calculating full hashes for {len(candidate_ids):,d} possible duplicates...")
+	path_map = get_full_paths_bulk(db, candidate_ids)
+	candidates = [(file_id, path_map[file_id]) for file_id in candidate_ids if file_id in path_map]
+
+	file_ids, file_hashes = [], []
+	with ThreadPoolExecutor(max_workers=max_workers or HASH_WORKERS) as executor:
+		results = executor.map(calculate_sha384, (full_path for _, full_path in candidates))
+		for (file_id, _), file_hash in zip(candidates, results):
+			if file_hash is None:
+				continue
+			file_ids.append(file_id)
+			file_hashes.append(file_hash)
+
+			if len(file_ids) >= UPSERT_BATCH_SIZE:
+				db.execute(_STMT_SET_FULL_HASHES, {"file_ids": file_ids, "file_hashes": file_hashes})
+				file_ids, file_hashes = [], []
+
+	if file_ids:
+		db.execute(_STMT_SET_FULL_HASHES, {"file_ids": file_ids, "file_hashes": file_hashes})
@@ -0,0 +1,45 @@
+# tests/test_database.py
+
+from collections import namedtuple
+
+from src.file_dimension.database import _build_path_map
+
+Row = namedtuple("Row", ["id", "parent_id", "file_name"])
+
+
+def test_build_path_map_resolves_nested_paths():
+	"""
+	Verify that the root maps to '/' and nested records get their full
+	paths, even when children come before their parents in the rows.
+	"""
+	rows = [
+		Row(4, 3, "file.txt"),
+		Row(3, 2, "b"),
+		Row(1, None, "/"),
+		Row(2, 1, "a"),
+		Row(5, 1, "top.txt"),
+	]
+
+	assert _build_path_map(rows) == {
+		1: "/",
+		2: "/a",
+		3: "/a/b",
+		4: "/a/b/file.txt",
+		5: "/top.txt",
+	}
+
+
+def test_build_path_map_skips_orphans():
+	"""
+	Verify that a record whose parent is missing from the rows, and its
+	children, get no path rather than a relative one, while the rest of
+	the tree still resolves.
+	"""
+	rows = [
+		Row(8, 7, "child.txt"),
+		Row(1, None, "/"),
+		Row(7, 99, "orphan"),
+		Row(2, 1, "a"),
+	]
+
+	assert _build_path_map(rows) == {1: "/", 2: "/a"}
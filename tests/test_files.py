@@ -0,0 +1,87 @@
+# tests/test_files.py
+
+import mimetypes
+import os
+
+import pytest
+
+from src.file_dimension.files import file_extension, find_files, guess_type_by_extension
+
+
+def make_tree(root):
+	"""
+	Builds a small tree under root:
+	    top.txt
+	    sub/mid.txt
+	    sub/deeper/low.txt
+	    link -> sub (a symlinked directory)
+	"""
+	(root / "sub" / "deeper").mkdir(parents=True)
+	(root / "top.txt").write_text("top")
+	(root / "sub" / "mid.txt").write_text("mid")
+	(root / "sub" / "deeper" / "low.txt").write_text("low")
+	(root / "link").symlink_to(root / "sub", target_is_directory=True)
+
+
+def test_find_files_walks_nested_directories(tmp_path):
+	"""
+	Verify that files in nested directories are all found, with each
+	directory's files yielded before its subdirectories are visited.
+	"""
+	make_tree(tmp_path)
+
+	files = list(find_files(str(tmp_path)))
+
+	assert [info.file_name for info in files] == ["top.txt", "mid.txt", "low.txt"]
+	assert [info.file_size for info in files] == [3, 3, 3]
+
+
+def test_find_files_does_not_follow_symlinked_directories(tmp_path):
+	"""
+	Verify that a symlinked directory is not descended into, so the files
+	behind it are only found once, through their real path.
+	"""
+	make_tree(tmp_path)
+
+	full_paths = [info.full_path for info in find_files(str(tmp_path))]
+
+	assert not any(path.startswith(str(tmp_path / "link")) for path in full_paths)
+	assert full_paths.count(str(tmp_path / "sub" / "mid.txt")) == 1
+
+
+def test_find_files_sets_parent_path(tmp_path):
+	"""
+	Verify that each file's parent_path is its directory, and that files in
+	the same directory share one parent_path object.
+	"""
+	make_tree(tmp_path)
+	(tmp_path / "sub" / "other.txt").write_text("other")
+
+	files = {info.file_name: info for info in find_files(str(tmp_path))}
+
+	assert files["top.txt"].parent_path == str(tmp_path)
+	assert files["mid.txt"].parent_path == str(tmp_path / "sub")
+	assert files["low.txt"].parent_path == str(tmp_path / "sub" / "deeper")
+	assert files["mid.txt"].parent_path is files["other.txt"].parent_path
+	for info in files.values():
+		assert info.full_path == os.path.join(info.parent_path, info.file_name)
+
+
+@pytest.mark.parametrize("file_name", [
+	"a.tar.gz",
+	"a.tar.Z",
+	"data.csv.Z",
+	"a.tgz",
+	"X.TAR.GZ",
+	".bashrc",
+	"README",
+	"app.3f9a1c.js",
+	"IMG 10.15.30.png",
+	"log.2024-01-01.gz",
+])
+def test_guess_type_by_extension_matches_mimetypes(file_name):
+	"""
+	Verify that the cached guess from file_extension() gives the same MIME
+	type as mimetypes.guess_type() on the whole name.
+	"""
+	assert guess_type_by_extension(file_extension(file_name)) == mimetypes.guess_type(file_name)[0]
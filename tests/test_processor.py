@@ -1,12 +1,14 @@
 # tests/test_processor.py
 
+import hashlib
 from datetime import datetime, timedelta
 
 # In tests/test_processor.py
 import pytest
 
 from src.file_dimension import processor
-from src.file_dimension.database import SessionLocal, engine, text
+from src.file_dimension.database import SessionLocal, engine, ensure_path_exists, text
+from src.file_dimension.files import FileInfo
 
 
 @pytest.fixture
@@ -76,9 +78,9 @@ def test_process_directory_inserts_new_file(db_session, mocker):
 
 	# 2. Mock: Hijack the filesystem functions to control their output
 	# Mock find_files to return our one fake file
-	mocker.patch('src.file_dimension.processor.find_files', return_value=[fake_file_data])
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**fake_file_data)])
 	# Mock calculate_sha384 to return a fixed hash
-	mocker.patch('src.file_dimension.processor.calculate_sha384', return_value='fake_hash_string')
+	mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'fake').digest())
 
 	# 3. Act: Run the processor on a dummy directory
 	# processor.process_directory("/test")
@@ -94,7 +96,7 @@ def test_process_directory_inserts_new_file(db_session, mocker):
 
 	assert result is not None
 	assert result.file_name == "foo.txt"
-	assert result.file_hash == b'fake_hash_string'  # Driver encodes it to bytes
+	assert result.file_hash == hashlib.sha384(b'fake').digest()  # Raw 48-byte digest
 	assert result.file_size == 123
 
 
@@ -110,7 +112,7 @@ def test_process_directory_updates_existing_file(db_session, mocker):
 	).scalar_one()
 
 	old_file_name = "foo.txt"
-	old_hash = "old_hash_string"
+	old_hash = hashlib.sha384(b"old").digest()
 	old_mtime = datetime.now().astimezone() - timedelta(days=1)
 
 	# Insert the initial file record
@@ -120,11 +122,11 @@ def test_process_directory_updates_existing_file(db_session, mocker):
             VALUES (:parent_id, :name, :hash, :mtime, FALSE)
             RETURNING id
         """),
-		{"parent_id": parent_id, "name": old_file_name, "hash": old_hash.encode(), "mtime": old_mtime}
+		{"parent_id": parent_id, "name": old_file_name, "hash": old_hash, "mtime": old_mtime}
 	).scalar_one()
 
 	# 2. Mock: Create "new" data for the same file that has been "modified".
-	new_hash = "new_hash_string"
+	new_hash = hashlib.sha384(b"new").digest()
 	new_mtime = datetime.now().astimezone()
 
 	new_file_data = {
@@ -139,7 +141,7 @@ def test_process_directory_updates_existing_file(db_session, mocker):
 		"inode": 101,
 	}
 
-	mocker.patch('src.file_dimension.processor.find_files', return_value=[new_file_data])
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**new_file_data)])
 	mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=new_hash)
 
 	# 3. Act: Run the processor.
@@ -156,8 +158,371 @@ def test_process_directory_updates_existing_file(db_session, mocker):
 	).first()
 
 	assert updated_record is not None
-	assert updated_record.file_hash.decode() == new_hash
+	assert updated_record.file_hash == new_hash
 	assert int(updated_record.modified_at.timestamp()) == int(new_mtime.timestamp())
 	assert updated_record.file_size == 456
 
 
+def test_process_directory_large_file_gets_head_hash_only(db_session, mocker):
+	"""
+	Verify that a large file with no size/head-hash match is stored with
+	only its head hash, and is never hashed in full.
+	"""
+	large_file_data = {
+		"full_path": "/test/big.iso",
+		"parent_path": "/test",
+		"file_name": "big.iso",
+		"file_size": 10 * 1024 * 1024,
+		"mimetype": "application/octet-stream",
+		"modified_at": datetime.now().astimezone(),
+		"mtime_ts": datetime.now().timestamp(),
+		"device_id": 1,
+		"inode": 102,
+	}
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**large_file_data)])
+	mocker.patch('src.file_dimension.processor.calculate_head_hash', return_value=hashlib.sha384(b'head').digest())
+	full_hash = mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'full').digest())
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1
+	)
+
+	result = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE file_name = 'big.iso'")
+	).first()
+
+	assert result is not None
+	assert result.head_hash == hashlib.sha384(b'head').digest()
+	assert result.file_hash is None
+	assert result.hash_type == 'head'
+	full_hash.assert_not_called()
+
+
+def test_process_directory_skips_unchanged_file(db_session, mocker):
+	"""
+	Verify that a file whose size, device, inode and mtime match its existing
+	record is not hashed again.
+	"""
+	parent_id = db_session.execute(
+		text("INSERT INTO public.dim_file (parent_id, file_name, is_directory) VALUES (1, 'test', TRUE) RETURNING id")
+	).scalar_one()
+
+	mtime = datetime.now().astimezone() - timedelta(days=1)
+	db_session.execute(
+		text("""
+            INSERT INTO public.dim_file (
+                parent_id, file_name, file_hash, head_hash, hash_type,
+                file_size, device_id, inode, modified_at, is_directory
+            ) VALUES (:parent_id, 'foo.txt', :hash, :hash, 'full', 123, 1, 101, :mtime, FALSE)
+        """),
+		{"parent_id": parent_id, "hash": hashlib.sha384(b"old").digest(), "mtime": mtime}
+	)
+
+	unchanged_file_data = {
+		"full_path": "/test/foo.txt",
+		"parent_path": "/test",
+		"file_name": "foo.txt",
+		"file_size": 123,
+		"mimetype": "text/plain",
+		"modified_at": mtime,
+		"mtime_ts": mtime.timestamp(),
+		"device_id": 1,
+		"inode": 101,
+	}
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**unchanged_file_data)])
+	sha384 = mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'new').digest())
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1
+	)
+
+	sha384.assert_not_called()
+	result = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE file_name = 'foo.txt'")
+	).first()
+	assert result.file_hash == hashlib.sha384(b'old').digest()
+
+
+def test_process_directory_rehashes_legacy_row(db_session, mocker):
+	"""
+	Verify that a row hashed before two-tier hashing (file_hash set, no
+	head_hash or hash_type) is hashed again, even though its size, device,
+	inode and mtime are unchanged, so that it gets a head hash.
+	"""
+	parent_id = db_session.execute(
+		text("INSERT INTO public.dim_file (parent_id, file_name, is_directory) VALUES (1, 'test', TRUE) RETURNING id")
+	).scalar_one()
+
+	mtime = datetime.now().astimezone() - timedelta(days=1)
+	db_session.execute(
+		text("""
+            INSERT INTO public.dim_file (
+                parent_id, file_name, file_hash,
+                file_size, device_id, inode, modified_at, is_directory
+            ) VALUES (:parent_id, 'foo.txt', :hash, 123, 1, 101, :mtime, FALSE)
+        """),
+		{"parent_id": parent_id, "hash": hashlib.sha384(b"legacy").digest(), "mtime": mtime}
+	)
+
+	legacy_file_data = {
+		"full_path": "/test/foo.txt",
+		"parent_path": "/test",
+		"file_name": "foo.txt",
+		"file_size": 123,
+		"mimetype": "text/plain",
+		"modified_at": mtime,
+		"mtime_ts": mtime.timestamp(),
+		"device_id": 1,
+		"inode": 101,
+	}
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**legacy_file_data)])
+	sha384 = mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'legacy').digest())
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1
+	)
+
+	sha384.assert_called_once()
+	result = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE file_name = 'foo.txt'")
+	).first()
+	assert result.head_hash == hashlib.sha384(b'legacy').digest()
+	assert result.hash_type == 'full'
+
+
+def test_process_directory_updates_inode_of_moved_file(db_session, mocker):
+	"""
+	Verify that a file with the same content and mtime but a new inode (e.g.
+	restored with cp -p) has its row updated, so it's skipped next time.
+	"""
+	parent_id = db_session.execute(
+		text("INSERT INTO public.dim_file (parent_id, file_name, is_directory) VALUES (1, 'test', TRUE) RETURNING id")
+	).scalar_one()
+
+	file_hash = hashlib.sha384(b"same").digest()
+	mtime = datetime.now().astimezone() - timedelta(days=1)
+	db_session.execute(
+		text("""
+            INSERT INTO public.dim_file (
+                parent_id, file_name, file_hash, head_hash, hash_type,
+                file_size, device_id, inode, modified_at, is_directory
+            ) VALUES (:parent_id, 'foo.txt', :hash, :hash, 'full', 123, 1, 101, :mtime, FALSE)
+        """),
+		{"parent_id": parent_id, "hash": file_hash, "mtime": mtime}
+	)
+
+	moved_file_data = {
+		"full_path": "/test/foo.txt",
+		"parent_path": "/test",
+		"file_name": "foo.txt",
+		"file_size": 123,
+		"mimetype": "text/plain",
+		"modified_at": mtime,
+		"mtime_ts": mtime.timestamp(),
+		"device_id": 1,
+		"inode": 202,
+	}
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**moved_file_data)])
+	mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=file_hash)
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1
+	)
+
+	result = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE file_name = 'foo.txt'")
+	).first()
+	assert result.inode == 202
+
+
+def test_process_directory_fully_hashes_duplicate_candidates(db_session, mocker):
+	"""
+	Verify that large files sharing a size and head hash are both promoted
+	to a full hash after the scan.
+	"""
+	mtime = datetime.now().astimezone()
+	candidate_files = [
+		FileInfo(
+			full_path=f"/test/{name}",
+			parent_path="/test",
+			file_name=name,
+			file_size=10 * 1024 * 1024,
+			mimetype="application/octet-stream",
+			modified_at=mtime,
+			mtime_ts=mtime.timestamp(),
+			device_id=1,
+			inode=inode,
+		)
+		for name, inode in (("a.iso", 201), ("b.iso", 202))
+	]
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=candidate_files)
+	mocker.patch('src.file_dimension.processor.calculate_head_hash', return_value=hashlib.sha384(b'head').digest())
+	full_hash = mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'full').digest())
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1
+	)
+
+	results = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE file_name IN ('a.iso', 'b.iso')")
+	).all()
+
+	assert len(results) == 2
+	for result in results:
+		assert result.hash_type == 'full'
+		assert result.file_hash == hashlib.sha384(b'full').digest()
+	assert sorted(call.args[0] for call in full_hash.call_args_list) == ["/test/a.iso", "/test/b.iso"]
+
+
+def test_process_directory_skips_hard_linked_candidates(db_session, mocker):
+	"""
+	Verify that two hard links to the same large file (same device and
+	inode) are not read in full, since they can't be reported as duplicates.
+	"""
+	mtime = datetime.now().astimezone()
+	linked_files = [
+		FileInfo(
+			full_path=f"/test/{name}",
+			parent_path="/test",
+			file_name=name,
+			file_size=10 * 1024 * 1024,
+			mimetype="application/octet-stream",
+			modified_at=mtime,
+			mtime_ts=mtime.timestamp(),
+			device_id=1,
+			inode=301,
+		)
+		for name in ("a.iso", "a-link.iso")
+	]
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=linked_files)
+	mocker.patch('src.file_dimension.processor.calculate_head_hash', return_value=hashlib.sha384(b'head').digest())
+	full_hash = mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'full').digest())
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1
+	)
+
+	hash_types = db_session.execute(
+		text("SELECT hash_type FROM public.dim_file WHERE file_name IN ('a.iso', 'a-link.iso')")
+	).scalars().all()
+
+	assert hash_types == ['head', 'head']
+	full_hash.assert_not_called()
+
+def test_ensure_path_exists_creates_uncached_chain(db_session):
+	"""
+	Verify that a path several levels below the deepest cached directory is
+	created in one go, and that every new level's ID is cached.
+	"""
+	a_id = db_session.execute(
+		text("INSERT INTO public.dim_file (parent_id, file_name, is_directory) VALUES (1, 'a', TRUE) RETURNING id")
+	).scalar_one()
+	cache = {"/": 1, "/a": a_id}
+
+	c_id = ensure_path_exists(db_session, "/a/b/c", cache)
+
+	b_row = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE parent_id = :parent_id AND file_name = 'b'"),
+		{"parent_id": a_id}
+	).first()
+	c_row = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE id = :file_id"),
+		{"file_id": c_id}
+	).first()
+
+	assert cache["/a/b"] == b_row.id
+	assert cache["/a/b/c"] == c_id
+	assert c_row.parent_id == b_row.id
+	assert b_row.is_directory and c_row.is_directory
+
+
+def test_ensure_path_exists_turns_replaced_file_into_directory(db_session):
+	"""
+	Verify that a file row whose name is now a directory becomes a directory
+	row, without the old file's hash and size.
+	"""
+	file_id = db_session.execute(
+		text("""
+            INSERT INTO public.dim_file (
+                parent_id, file_name, file_hash, head_hash, hash_type, file_size, is_directory
+            ) VALUES (1, 'test', :hash, :hash, 'full', 123, FALSE)
+            RETURNING id
+        """),
+		{"hash": hashlib.sha384(b"old").digest()}
+	).scalar_one()
+
+	dir_id = ensure_path_exists(db_session, "/test", {"/": 1})
+
+	result = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE id = :file_id"),
+		{"file_id": dir_id}
+	).first()
+	assert dir_id == file_id
+	assert result.is_directory
+	assert result.file_hash is None
+	assert result.head_hash is None
+	assert result.file_size is None
+
+
+def test_process_directory_bulk_restores_indexes(db_session, mocker):
+	"""
+	Verify that a bulk load inserts the file and leaves dim_file with the
+	same indexes, and index comments, it started with.
+	"""
+	# A comment with characters that a bind-parameter parser would trip over
+	index_comment = "Duplicate candidates: size, then head hash (100% of large files)"
+	db_session.execute(
+		text("COMMENT ON INDEX public.idx_file_dimension_size_head_hash IS 'Duplicate candidates\\: size, then head hash (100% of large files)'")
+	)
+	comment_query = text("SELECT obj_description('public.idx_file_dimension_size_head_hash'::regclass, 'pg_class')")
+	index_query = text("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = 'dim_file'")
+	indexes_before = set(db_session.execute(index_query).scalars())
+
+	mtime = datetime.now().astimezone()
+	bulk_file_data = {
+		"full_path": "/test/foo.txt",
+		"parent_path": "/test",
+		"file_name": "foo.txt",
+		"file_size": 123,
+		"mimetype": "text/plain",
+		"modified_at": mtime,
+		"mtime_ts": mtime.timestamp(),
+		"device_id": 1,
+		"inode": 101,
+	}
+
+	mocker.patch('src.file_dimension.processor.find_files', return_value=[FileInfo(**bulk_file_data)])
+	mocker.patch('src.file_dimension.processor.calculate_sha384', return_value=hashlib.sha384(b'bulk').digest())
+
+	processor.process_directory(
+		db=db_session,
+		root_directory="/test",
+		max_files_override=-1,
+		bulk=True
+	)
+
+	result = db_session.execute(
+		text("SELECT * FROM public.dim_file WHERE file_name = 'foo.txt'")
+	).first()
+	assert result is not None
+	assert result.file_hash == hashlib.sha384(b'bulk').digest()
+	assert set(db_session.execute(index_query).scalars()) == indexes_before
+	assert db_session.execute(comment_query).scalar_one() == index_comment